@@ -9,11 +9,59 @@ profile if it sees too shallow a depth. The mvp_relay program avfoids
 this problem by withholding zero depths from the MVP controller.
 """
 
+import ctypes
+import errno
+import os
 import time
 import threading
-import queue
+import re
+import selectors
 import socket
+from collections import deque
+import queue
+from functools import partial, reduce
+from operator import xor
 import logging
+
+# numpy is optional; when present, checksums for multi-sentence bursts
+# are XOR-reduced in one vectorized pass instead of per sentence.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional compiled checksum kernel (see nmea_fast.pyx / setup.py);
+# checksum_valid validates a whole framed sentence (XOR plus hex
+# compare) in one C pass. Single sentences fall back to the reduce()
+# path when the extension has not been built.
+try:
+    from nmea_fast import checksum_valid as _checksum_valid
+except ImportError:
+    _checksum_valid = None
+
+# numba is a further optional fallback for the per-sentence XOR when
+# the Cython kernel has not been built: LLVM vectorizes the plain
+# index loop into a SIMD reduction. Compiled (and cached) at import so
+# the first real sentence pays no JIT cost.
+if _checksum_valid is None and np is not None:
+    try:
+        from numba import njit
+    except ImportError:
+        njit = None
+else:
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def _nmea_xor(buf):
+        c = 0
+        for i in range(buf.shape[0]):
+            c ^= buf[i]
+        return c
+
+    _nmea_xor(np.frombuffer(b'SDDPT,0.0,0.0', dtype=np.uint8))
+else:
+    _nmea_xor = None
 import faulthandler
 import signal
 
@@ -35,10 +83,10 @@ mvpControllerIP = "10.248.237.173"
 # ...MVP controller should be set to listen on this port for
 # UDP datagrams.
 udpOutPort = 2021
-# Port numbers for receiving data via UDP datagram. Echosounder, etc.,
-# should be set to send data on these ports. udpInPorts is a list
-# variable, with port numbers separated by commas. Can contain zero,
-# one or more port numbers.
+# Input (host, port) pairs for receiving navigation data. Despite the
+# udp* names (kept so old configs still read naturally), these are TCP
+# servers on the instruments that we connect to; the Tully 2022 feeds
+# are published that way. Can contain zero, one or more entries.
 # Tully 2022:
 udpInPorts = [('10.248.237.222', 1025), ('10.248.237.222', 1032)]
 
@@ -46,6 +94,26 @@ udpInPorts = [('10.248.237.222', 1025), ('10.248.237.222', 1032)]
 udpInBufferLength = 1024 # [bytes]
 UDPTIMEOUT = 10 # [seconds]
 
+# Minimum wait before retrying a feed whose connection failed or
+# dropped, so a dead host cannot monopolize the reader thread.
+RECONNECTSECONDS = 5 # [seconds]
+
+# Maximum number of reads drained from a socket per wakeup before the
+# batch is processed and handed to the display queue.
+MAXRECVBURST = 32
+
+# Maximum datagrams the sender thread drains from the transmit queue
+# and hands to one sendmmsg call.
+MAXSENDBATCH = 64
+
+# Kernel socket buffer sizes. Large receive buffers keep bursty
+# depthsounder/GPS traffic from being dropped before we can drain it.
+# The kernel silently caps these to net.core.rmem_max/wmem_max, so the
+# granted size is logged; bump the sysctls (e.g.
+# ``sysctl -w net.core.rmem_max=4194304``) if the cap is hit.
+SOCKETRCVBUF = 4*1024*1024 # [bytes]
+SOCKETSNDBUF = 1*1024*1024 # [bytes]
+
 
 # Port numbers for receiving data via serial port. serialInPorts is a
 # list variable identifying serial ports. For portability between
@@ -122,33 +190,54 @@ class ThreadedClient:
     endApplication could reside in the GUI part, but putting them here
     means that you have all the thread controls in a single place.
     """
+
+    # No per-instance __dict__: attribute access from the per-packet
+    # paths goes through fixed slot offsets instead of a dict lookup.
+    __slots__ = ('serialQueue', 'udpQueue', '_wake', 'droppedLines',
+                 '_droppedLogged', '_lastDropLog', 'running', 'num',
+                 'serialRelayThreads', 'readerThread', 'restart', 'ser')
+
     def __init__(self):
         """
         Start the asynchronous threads. We are in the main
         (original) thread of the application.
         """
 
-        # Create the queues.
-        self.serialQueue = queue.Queue()
-        self.udpQueue = queue.Queue()
+        # Create the queues. Plain deques: append/popleft are atomic
+        # under the GIL, so the single-producer/single-consumer handoff
+        # needs no lock, and maxlen bounds memory if the consumer ever
+        # falls behind (old display lines just fall off the front).
+        self.serialQueue = deque(maxlen=4096)
+        self.udpQueue = deque(maxlen=4096)
+
+        # Producers set this after appending so the consumer wakes
+        # immediately instead of sleeping a fixed interval.
+        self._wake = threading.Event()
+
+        # Lines pushed out of a full deque by a stalled consumer.
+        # Dropping the oldest is fine for display purposes, but it
+        # should not happen silently.
+        self.droppedLines = 0
+        self._droppedLogged = 0
+        self._lastDropLog = 0.0
 
         self.running = True
         self.num = 1
 
+        self.serialRelayThreads = {}
+
         for serialInPort in serialInPorts:
             self.serialRelayThreads[serialInPort] = \
                 threading.Thread(target=self.serialThread, args=(serialInPort,))
             self.serialRelayThreads[serialInPort].start()
 
-        # Start thread(s) for relaying UDP data to MVP controller.
-        self.udpRelayThreads = {} # (dictionary variable)
-
-        # make a listening thread for each udp port
+        # Start a single reader thread that multiplexes all the
+        # network input ports with a selector, rather than one
+        # blocking thread per port.
         for udpInPort in udpInPorts:
             logger.info(f'udpInPort {udpInPort}')
-            self.udpRelayThreads[udpInPort[1]] = \
-                threading.Thread(target=self.udpThread, args=(udpInPort,))
-            self.udpRelayThreads[udpInPort[1]].start()
+        self.readerThread = threading.Thread(target=self.readNetwork)
+        self.readerThread.start()
 
         # Start the periodic call in the GUI to check if the queue contains
         # anything
@@ -156,12 +245,12 @@ class ThreadedClient:
 
     def processIncoming(self):
         """
-        Handle all the messages currently in the queue (if any).
+        Drain the display queues. Parsing and relaying now happen in
+        the reader threads; the queues only carry the timestamped
+        display lines.
         """
-        #global lastDepthEpochTime
-        #global lastDepthCloseTime
-
         logger = logging.getLogger('processIncoming')
+        # Local bindings: the drain loop below touches these per line.
         qs = [self.udpQueue]
         qnames = ['UDP']
 
@@ -169,52 +258,37 @@ class ThreadedClient:
             qs += [self.serialQueue]
             qnames += ['Serial']
 
+        drained = 0
         for q, qname in zip(qs, qnames):
-            logger.debug(f'Processing queue: {qname}')
-            qsize = q.qsize()
-            logger.debug(f'   queue size: {qsize}')
-            if qsize > 0:
-                getSucceeded = False
+            # Drain everything that has arrived; popleft takes no lock.
+            while True:
                 try:
-                    msg = q.get(block=True, timeout=2)
-                    logger.debug(f'Get: {msg}')
-                    getSucceeded = True
-                except queue.Empty:
-                    getSucceeded = False
-
-                if getSucceeded:
-                    logger.debug('Succeded get')
-                    # Log the message without modification, apart from adding
-                    # a timestamp.
-                    datedMsg = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()) + '--' + msg
-                    datedMsg = datedMsg.rstrip()
-                    logMessage(datedMsg)
-                    # Relay the message if it is of correct format or if it can be
-                    # converted to the correct format with minimal tweaking.
-                    try:
-                        msgs = msg_split(msg)
-                    except:
-                        print('grrr')
-                    mout = []
-                    logger.debug(f'msgs {msgs}')
-                    for msg in msgs:
-                        m, isGoodStr = clean_nmea_str(msg)
-                        if isGoodStr:
-                            mout.append(m)
-                    logger.debug(f'mout + {mout}')
-                    logger.debug('<<<mout')
-
-                    # Relay the message if it is of correct format.
-                    if len(mout)>0:
-                        for msg in mout:
-                            logger.debug(f'relay {msg}')
-                            relayMessage(msg)
-                    else:
-                        self.restart=True
+                    line = q.popleft()
+                except IndexError:
+                    break
+                drained += 1
+                logger.debug('%s: %s', qname, line)
+
+        # Report overflow drops at most once a second.
+        if self.droppedLines > self._droppedLogged:
+            now = time.time()
+            if now - self._lastDropLog >= 1.0:
+                logger.warning('display queues dropped %d lines total',
+                               self.droppedLines)
+                self._droppedLogged = self.droppedLines
+                self._lastDropLog = now
+
+        if drained == 0:
+            # Nothing pending anywhere; sleep until a producer signals
+            # (the timeout just re-checks self.running now and then).
+            self._wake.wait(timeout=0.5)
+        self._wake.clear()
 
     def periodicCall(self):
         """
-        Check every 100 ms if there is something new in the queue and process it.
+        Process the queues as messages arrive; processIncoming naps
+        only when both queues are empty, so a burst is drained at full
+        speed.
         """
         try:
             while True:
@@ -226,251 +300,612 @@ class ThreadedClient:
                     for serialInPort in self.serialRelayThreads.keys():
                         self.serialRelayThreads[serialInPort].join()
 
-                    # Wait for UDP thread(s) to complete.
-                    for udpInPort in self.udpRelayThreads.keys():
-                        self.udpRelayThreads[udpInPort].join()
+                    # Wait for the network reader thread to complete.
+                    self.readerThread.join()
 
                     import sys
                     sys.exit(1)
 
-                time.sleep(0.1)
-        except:
+        except KeyboardInterrupt:
             self.endApplication()
 
     def serialThread(self,serialInPort):
 
-        # Open serial port.
+        # Open serial port. Without a port there is nothing for this
+        # thread to do.
         try:
             self.ser = serial.Serial(serialInPort,baudRate,\
                                     bytesize=byteSize,parity=parity,\
                                     stopbits=stopBits,timeout=timeOut,\
                                     xonxoff=xonxoff,rtscts=rtscts,\
                                     interCharTimeout=interCharTimeout)
-        except:
-            print('Failed to open serial port')
+        except serial.SerialException:
+            logger.warning('Failed to open serial port %s', serialInPort)
+            return
 
+        failures = 0
         while self.running:
 
-            # Read in data from network.
-            serialData = ''
+            # Read in data from serial port.
+            serialData = b''
 
             try:
                 serialData = self.ser.readline()
-                print(serialData)
-            except:
-                pass
+            except serial.SerialException:
+                failures += 1
+                logger.warning('Serial read failed on %s (%d so far)',
+                               serialInPort, failures)
 
             # If serial connection timed out, then serialData will be empty.
             if len(serialData) > 0:
-                self.serialQueue.put(serialData)
+                datedMsg, _ = _process_and_relay(serialData)
+                if len(self.serialQueue) == self.serialQueue.maxlen:
+                    self.droppedLines += 1
+                self.serialQueue.append(datedMsg)
+                self._wake.set()
 
         # Close incoming serial connection.
         try:
             self.ser.close()
-        except:
+        except (serial.SerialException, OSError):
             pass
 
-    def udpThread(self, udpInPort):
+    def readNetwork(self):
         """
-        Thread for each udp port to listen and fill the udp queue
+        Single thread that multiplexes all the network input ports
+        with a selector (epoll under Linux), instead of one blocking
+        thread per port. Connects are non-blocking and failed feeds
+        are retried on a per-address timer, so a dead host never
+        stalls reads from the healthy ones.
         """
-        logger = logging.getLogger('udpThread')
-        logger.debug('udpInPort is ' + str(udpInPort))
+        logger = logging.getLogger('readNetwork')
+        sel = selectors.DefaultSelector()
+        # Address -> earliest time to try connecting again.
+        pending = {}
+
+        # One reusable receive buffer for the whole thread; recv_into
+        # avoids allocating a fresh bytes object per read, and only
+        # the filled slice is copied out for the batch.
+        rxbuf = bytearray(udpInBufferLength)
+        rxview = memoryview(rxbuf)
+
+        def openSocket(relayAddr):
+            inSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            inSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # The instrument feeds are long-lived TCP connections;
+            # keepalive notices a silently dead peer, and NODELAY
+            # keeps short NMEA lines from being held back by Nagle.
+            inSocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            inSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            inSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                SOCKETRCVBUF)
+            logger.debug('SO_RCVBUF granted: %d',
+                         inSocket.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_RCVBUF))
+            # Non-blocking connect: the reader thread must never sit
+            # in a SYN retry while a healthy feed has data waiting. A
+            # socket mid-handshake parks in the selector for
+            # EVENT_WRITE until the connect resolves (or its deadline
+            # passes); established sockets watch EVENT_READ.
+            inSocket.setblocking(False)
+            err = inSocket.connect_ex(relayAddr)
+            if err == 0:
+                sel.register(inSocket, selectors.EVENT_READ, relayAddr)
+            elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sel.register(inSocket, selectors.EVENT_WRITE,
+                             (relayAddr, time.time() + UDPTIMEOUT))
+            else:
+                inSocket.close()
+                raise OSError(err, os.strerror(err))
 
-        # Create socket for listening to incoming UDP data.
-        relayAddr = udpInPort
-        inUdpSocket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        for relayAddr in udpInPorts:
+            try:
+                openSocket(relayAddr)
+            except OSError:
+                logger.warning(f'Could not connect to {relayAddr}, '
+                               'will retry')
+                pending[relayAddr] = time.time() + RECONNECTSECONDS
 
         while self.running:
-            # Read in data from network.
-            logger.debug('#### while')
-
-            with socket.socket(socket.AF_INET,socket.SOCK_STREAM) as inUdpSocket:
-                inUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                inUdpSocket.settimeout(UDPTIMEOUT)
-                # ...Bind incoming UDP socket to address of local machine.
-                inUdpSocket.connect(relayAddr)
-
+            for key, mask in sel.select(timeout=1.0):
+                inSocket = key.fileobj
+
+                if mask & selectors.EVENT_WRITE:
+                    # A pending non-blocking connect has resolved.
+                    relayAddr = key.data[0]
+                    err = inSocket.getsockopt(socket.SOL_SOCKET,
+                                              socket.SO_ERROR)
+                    sel.unregister(inSocket)
+                    if err == 0:
+                        sel.register(inSocket, selectors.EVENT_READ,
+                                     relayAddr)
+                    else:
+                        inSocket.close()
+                        logger.warning(f'Could not connect to '
+                                       f'{relayAddr}, will retry')
+                        pending[relayAddr] = time.time() + RECONNECTSECONDS
+                    continue
+
+                relayAddr = key.data
+
+                # Drain whatever is waiting without blocking, so a
+                # burst costs one wakeup rather than one per read.
+                batch = []
+                while len(batch) < MAXRECVBURST:
+                    try:
+                        n = inSocket.recv_into(rxbuf)
+                    except BlockingIOError:
+                        break
+                    except OSError:
+                        n = 0
+                    if n == 0:
+                        # Connection dropped; reconnect on the next
+                        # pass through the loop.
+                        logger.warning(f'Lost connection to {relayAddr}, '
+                                       'will reconnect')
+                        sel.unregister(inSocket)
+                        inSocket.close()
+                        pending[relayAddr] = time.time() + RECONNECTSECONDS
+                        break
+                    batch.append(bytes(rxview[:n]))
+                    self.num += 1
+
+                # Parse and relay right here on the reader thread;
+                # the queue only carries display lines, so the
+                # outbound send no longer waits on the consumer.
+                for d in batch:
+                    datedMsg, anyGood = _process_and_relay(d)
+                    if len(self.udpQueue) == self.udpQueue.maxlen:
+                        self.droppedLines += 1
+                    self.udpQueue.append(datedMsg)
+                    self._wake.set()
+                    if not anyGood:
+                        self.restart = True
+
+            now = time.time()
+
+            # Give up on handshakes that have outlasted the connect
+            # timeout; the kernel would hold them far longer.
+            for key in list(sel.get_map().values()):
+                if (key.events & selectors.EVENT_WRITE
+                        and now > key.data[1]):
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+                    logger.warning(f'Could not connect to {key.data[0]}, '
+                                   'will retry')
+                    pending[key.data[0]] = now + RECONNECTSECONDS
+
+            # Retry lost feeds whose wait has expired; the timer keeps
+            # an unreachable host from being hammered every pass.
+            for relayAddr, nextTry in list(pending.items()):
+                if now < nextTry:
+                    continue
+                del pending[relayAddr]
                 try:
-                    udpData = inUdpSocket.recv(udpInBufferLength)
-                    self.num+=1
-                    failures = 0
-                except:
-                    failures += 1
-                    logger.warning("Failed UDP receive, trying to reconnect")
-
-                # If UDP connection timed out, then udpData will be empty.
-                if len(udpData) > 0:
-                    logger.debug(f'udp: {udpData}')
-                    logger.debug(f'udp len: {len(udpData)}')
-                    # udpData is not empty; echo datagram to GUI.
-                    self.udpQueue.put(udpData.decode('utf8'))
-                    logger.debug(f'udp put done')
+                    openSocket(relayAddr)
+                except OSError:
+                    pending[relayAddr] = now + RECONNECTSECONDS
 
+        sel.close()
 
     def endApplication(self):
         self.running = 0
 
 
-def logMessage(msg):
-
-    global logFid, timeLastLogStarted
-
-    # Create new log file if necessary.
+# Timestamp strings only change once a second, so cache the formatted
+# string and only rerun strftime/localtime when the second rolls over.
+# The unlocked update is a benign race: at worst a message gets a
+# timestamp that is one second stale.
+_lastTsSec = 0
+_lastTsStr = ''
+
+
+def _now_ts():
+    global _lastTsSec, _lastTsStr
+    s = int(time.time())
+    if s != _lastTsSec:
+        _lastTsSec = s
+        _lastTsStr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s))
+    return _lastTsStr
+
+
+# Messages are accumulated as a list of pending lines and written out
+# in batches rather than paying a write()+flush() per datagram. The
+# batch is drained when it grows past _LOG_FLUSH_BYTES, and a
+# background timer thread flushes it every _LOG_FLUSH_SEC regardless so
+# log lines never sit in memory for long.
+_logLines = []
+_logBytes = 0
+_logBufLock = threading.Lock()
+_LOG_FLUSH_BYTES = 64*1024
+_LOG_FLUSH_SEC = 1.0
+# Below this aggregate size a single concatenated write() is cheaper;
+# above it os.writev() hands the kernel the lines directly and skips
+# the join copy.
+_WRITEV_MIN_BYTES = 4096
+
+# writev rejects more than IOV_MAX buffers per call (EINVAL), and a
+# 64 KiB burst of short dated lines holds more than 1024 of them.
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (OSError, ValueError):
+    _IOV_MAX = -1
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+
+def _drainLogLines():
+    # Write all pending lines to the log file. Caller must hold
+    # _logBufLock.
+    global _logBytes
+
+    if _logBytes >= _WRITEV_MIN_BYTES:
+        # Feed the kernel at most IOV_MAX buffers per call.
+        for i in range(0, len(_logLines), _IOV_MAX):
+            os.writev(logFid, _logLines[i:i + _IOV_MAX])
+    else:
+        os.write(logFid, b''.join(_logLines))
+    del _logLines[:]
+    _logBytes = 0
 
-    # ...Check if time to create new log file.
-    secondsSinceLastNewLog = time.time() - timeLastLogStarted
 
-    if secondsSinceLastNewLog > MINUTES_PER_LOG*60:
-        # Close existing log file.
-        if logFid != 0:
-            logFid.close()
+def flushLog():
+    with _logBufLock:
+        if logFid >= 0 and _logLines:
+            _drainLogLines()
 
-        # Log files will have names with start times encoded
-        # in them (e.g., 'mvp_relay_20081015164302.log').
-        nowStr = time.strftime("%Y%m%d%H%M%S",time.localtime())
-        newLogName = 'logs/mvp_relay_' + nowStr + '.log'
-        logFid = open(newLogName,'w')
-        timeLastLogStarted = time.time()
 
-    msg = msg + '\n'
-    logFid.write(msg)
-    logFid.flush()
+def _logFlushThread():
+    while True:
+        time.sleep(_LOG_FLUSH_SEC)
+        flushLog()
 
-def relayMessage(msg):
 
-    # Determine if this is a depth datagram or not.
-    fields = msg.split(',')
-    nmeaID = fields[0]
-    fields[-1] = fields[-1][:-3]
-    logger.debug(f'Fields {fields}')
-
-    logger.debug(f'relayed message: {msg}')
+def logMessage(msg):
 
-    if nmeaID == "$FKDBS":
-        pass
-    if nmeaID == "$SDDBS" or nmeaID == "$SDDPT" or nmeaID =='$PKEL9':
-        isDepthDataGram = True
-    else:
-        isDepthDataGram = False
+    global logFid, timeLastLogStarted, _logBytes
+
+    line = (msg + '\n').encode()
+
+    # The serial and network threads both log, so the whole
+    # check/close/reopen rotation sequence has to sit under the same
+    # lock as the buffer append; otherwise two producers in the
+    # rotation window can double-close the fd or write lines into a
+    # stale descriptor.
+    with _logBufLock:
+        # Create new log file if necessary.
+        if time.time() - timeLastLogStarted > MINUTES_PER_LOG*60:
+            # Close existing log file, draining any buffered lines
+            # into it first.
+            if logFid >= 0:
+                if _logLines:
+                    _drainLogLines()
+                os.close(logFid)
+
+            # Log files will have names with start times encoded
+            # in them (e.g., 'mvp_relay_20081015164302.log').
+            nowStr = time.strftime("%Y%m%d%H%M%S",time.localtime())
+            newLogName = 'logs/mvp_relay_' + nowStr + '.log'
+            # A raw fd, not a Python file object: the line batching
+            # above already amortizes the write() cost, so each drain
+            # is exactly one os.write/os.writev syscall with no buffer
+            # layer or file lock in between.
+            logFid = os.open(newLogName,
+                             os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            timeLastLogStarted = time.time()
+
+        _logLines.append(line)
+        _logBytes += len(line)
+        if _logBytes >= _LOG_FLUSH_BYTES:
+            _drainLogLines()
+
+def _relayGeneric(msg):
+    # Datagram is not a depth datagram; pass it straight through.
+    logger.info("Out:       " + msg.strip().decode('ascii', 'replace'))
+    return msg.strip() + b'\n'
+
+def _relayDrop(msg):
+    # Datagram the MVP controller has no use for; do not send it.
+    return None
+
+def _compile_field_parser(fieldIdx):
+    # Generate a parser specialized to one field position. The comma
+    # scan is unrolled for exactly the commas that precede the field,
+    # so extracting a depth allocates no field list at all; a missing
+    # comma surfaces as the same ValueError a bad float would.
+    src = ['def _parser(msg):']
+    src.append('    i = msg.index(b",")')
+    for _ in range(fieldIdx - 1):
+        src.append('    i = msg.index(b",", i + 1)')
+    src.append('    j = msg.find(b",", i + 1)')
+    src.append('    if j < 0:')
+    src.append('        j = msg.find(b"*", i + 1)')
+    src.append('        if j < 0:')
+    src.append('            j = len(msg)')
+    src.append('    return float(msg[i + 1:j])')
+    ns = {}
+    exec('\n'.join(src), ns)
+    return ns['_parser']
+
+# One compiled extractor per field position the handlers read.
+_fieldParsers = {idx: _compile_field_parser(idx) for idx in (1, 2, 3, 4, 5)}
+
+def _relayDepth(msg, depthField, nmeaName):
+    # Shared zero-depth filter for the single-depth-value formats:
+    # $SDDBS is what the Tully's Simrad ER60 multi-frequency
+    # echosounder outputs (we usually use the 18-kHz channel), with
+    # $FKDBS and $PKEL9 as variants from other sounders. The ER60
+    # outputs a zero-depth datagram whenever it cannot find the
+    # bottom, which causes the MVP controller to abort the cast,
+    # believing the water depth to be too shallow. Avoid this
+    # problem by checking that the datagram does not contain a
+    # zero depth before relaying it to the MVP controller.
+
+    # ...Determine depth from echosounder message, using the compiled
+    # extractor for this format's depth field.
+    try:
+        depth = _fieldParsers[depthField](msg)
+    except ValueError:
+        logger.warning('Bad or missing depth field in %s datagram: %s',
+                       nmeaName, msg)
+        return None
+
+    if depth != 0:
+        # Depth value is not zero, so it will be relayed to
+        # MVP controller.
+        logger.info("Out:       " + msg.decode('ascii', 'replace'))
+        return msg
+    return None
+
+def _relaySddpt(msg):
+    # Datagram is a depth datagram, but of $SDDPT format. This is
+    # the type of NMEA string that comes from the EA600
+    # Kongsburg-Simrad single-frequency sounder on the Tully (the
+    # EA600 is supposed to be able to output other formats, but
+    # the software is apparently buggy, and it will only output
+    # $SDDPT datagrams). It is not clear from the MVP manual that
+    # a $SDDPT datagram will be understood by the MVP software,
+    # but it must, since according to Jody Klymak, they used the
+    # EA600 on the Station P cruise for a while.
+
+    # Also according to Jody Klymak, the EA600 had the same problem
+    # with zero depths being sent to the MVP controller, causing
+    # profiles to be aborted. Not sure if the MVP software is using
+    # the depth below the transducer or the true depth, so test for
+    # zeroes in both.
+    # Only fields 1 and 2 are needed; the compiled extractors pull
+    # them out without building a field list.
+    try:
+        depthBelowT = _fieldParsers[1](msg)
+        depthBelowS = depthBelowT + _fieldParsers[2](msg)
+    except ValueError:
+        logger.warning('Bad depth fields in $SDDPT datagram: %s', msg)
+        return None
+    # ...Relay message to MVP controller.
+    msg = msg.strip() + b'\n'
+    if depthBelowT != 0 and depthBelowS != 0:
+        logger.info("Out depth:  " + msg.decode('ascii', 'replace'))
+        return msg
+    logger.info('zero depth withheld')
+    return None
+
+# Dispatch table mapping NMEA IDs to their handlers; anything not
+# listed here is passed through unmodified by _relayGeneric. Note that
+# $FKDBS now reaches its zero-depth filter, which the old depth-set
+# test accidentally bypassed. The depth formats share one body,
+# parameterized by which field carries the depth.
+_relayHandlers = {
+    b'$HEHDT': _relayDrop,
+    b'$PKEL9': partial(_relayDepth, depthField=5, nmeaName='$PKEL9'),
+    b'$SDDBS': partial(_relayDepth, depthField=3, nmeaName='$SDDBS'),
+    b'$FKDBS': partial(_relayDepth, depthField=4, nmeaName='$FKDBS'),
+    b'$SDDPT': _relaySddpt,
+}
+
+# IDs whose handler is a pure drop. Sentences for these never reach the
+# controller, so the validation pipeline skips the checksum/cleanup
+# work they would never use (they are still timestamped into the log).
+_DROP_IDS = frozenset(
+    nid for nid, handler in _relayHandlers.items() if handler is _relayDrop)
 
+def relayMessage(msg):
+    # Returns the datagram to send to the MVP controller, or None when
+    # the sentence is dropped or its depth withheld. The caller batches
+    # the actual sends (see _send_batch).
     if len(msg) == 0:
         # Do not send empty datagrams.
-        pass
-    elif not isDepthDataGram:
-        if nmeaID == "$HEHDT":
-            pass
-        else:
-            # Datagram is not a depth datagram.
-            try:
-                #outUdpSocket.sendto(msg.strip(),mvpAddr)
-                logger.info("Out:       "+msg.strip())
-                outUdpSocket.sendto((msg.strip()+'\n').encode(), mvpAddr)
-                #print "Out OK:       "+msg.strip()
-            except:
-                print('Send of non-depth datagram to controller computer failed')
-
-    elif nmeaID == "$PKEL9":
-        depthStr = fields[5]
-        depth = float(depthStr)
-        if depth != 0:
-            # Depth value is not zero, so it will be relayed to
-            # MVP controller. Record the time of this event.
-            # Relay message to MVP controller.
-            try:
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print('Send of $SDDBS datagram to controller computer failed')
-
-    elif nmeaID == "$SDDBS":
-        # Datagram is a depth datagram of "$SDDBS" format. This is the
-        # format output by the Tully's Simrad ER60 multi-frequency
-        # echosounder (we usually use the 18-kHz channel). The ER60
-        # outputs a zero-depth datagram whenever it cannot find the
-        # bottom, which causes the MVP controller to abort the cast,
-        # believing the water depth to be too shallow. Avoid this
-        # problem by checking that the datagram does not contain a
-        # zero depth before relaying it to the MVP controller.
-
-        # ...Determine depth from echosounder message.
-        depthStr = fields[3]
-        depth = float(depthStr)
-
-        if depth != 0:
-            # Depth value is not zero, so it will be relayed to
-            # MVP controller. Record the time of this event.
-            # Relay message to MVP controller.
-            try:
-                print("Out:       "+msg)
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print('Send of $SDDBS datagram to controller computer failed')
-
-    elif nmeaID == "$FKDBS":
-
-        # ...Determine depth from echosounder message.
-        depthStr = fields[4]
-        depth = float(depthStr)
-        print(depth)
-
-        if depth != 0:
-            # Depth value is not zero, so it will be relayed to
-            # MVP controller. Record the time of this event.
-            # Relay message to MVP controller.
-            try:
-                print("Out:       "+msg)
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print('Send of $FKDBS datagram to controller computer failed')
-    elif nmeaID == "$SDDPT":
-        logger.debug('Depth!')
-        # Datagram is a depth datagram, but of $SDDPT format. This is
-        # the type of NMEA string that comes from the EA600
-        # Kongsburg-Simrad single-frequency sounder on the Tully (the
-        # EA600 is supposed to be able to output other formats, but
-        # the software is apparently buggy, and it will only output
-        # $SDDPT datagrams). It is not clear from the MVP manual that
-        # a $SDDPT datagram will be understood by the MVP software,
-        # but it must, since according to Jody Klymak, they used the
-        # EA600 on the Station P cruise for a while.
-
-        # Also according to Jody Klymak, the EA600 had the same problem
-        # with zero depths being sent to the MVP controller, causing
-        # profiles to be aborted. Not sure if the MVP software is using
-        # the depth below the transducer or the true depth, so test for
-        # zeroes in both.
-        logger.debug(f'msg0 {msg} {fields}')
-        depthStr = fields[1]
-        offsetStr = fields[2]
-        depthBelowT = float(depthStr)
-        depthBelowS = depthBelowT + float(offsetStr)
-        # ...Relay message to MVP controller.
-        msg = msg.strip() + '\n'
-        #outUdpSocket.sendto(msg,mvpAddr)
-        logger.debug(f'msg {msg}')
-        if depthBelowT != 0 and depthBelowS != 0:
+        return None
+
+    # Identify the sentence by its first six bytes -- one hash lookup
+    # instead of a chain of string comparisons. Handlers that read
+    # fields do their own bounded split.
+    return _relayHandlers.get(msg[:6], _relayGeneric)(msg)
+
+# sendmmsg(2) lets a burst of outgoing datagrams go down in a single
+# syscall. It is Linux-only, so look it up in libc at import time and
+# fall back to one send() per datagram when it is not there.
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+try:
+    _sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+if _sendmmsg is not None:
+    # Header/iovec arrays reused by every _send_batch call, sized to
+    # the largest batch the sender thread hands over, so the hot path
+    # only fills in pointers and lengths instead of constructing
+    # fresh ctypes arrays per call. Only the sender thread touches
+    # them, so no locking is needed.
+    _txIovs = (_iovec * MAXSENDBATCH)()
+    _txHdrs = (_mmsghdr * MAXSENDBATCH)()
+    for _i in range(MAXSENDBATCH):
+        _txHdrs[_i].msg_hdr.msg_iov = ctypes.pointer(_txIovs[_i])
+        _txHdrs[_i].msg_hdr.msg_iovlen = 1
+    del _i
+
+def _send_batch(payloads):
+    # Send a batch of datagrams to the controller. The socket is
+    # connect()ed, so no per-datagram address is needed and the
+    # msg_name fields stay NULL.
+    if not payloads:
+        return
+    if _sendmmsg is not None and len(payloads) > 1:
+        while payloads:
+            n = min(len(payloads), MAXSENDBATCH)
+            for i in range(n):
+                # c_char_p points into the bytes object; payloads
+                # keeps them alive for the duration of the call.
+                p = payloads[i]
+                _txIovs[i].iov_base = ctypes.cast(
+                    ctypes.c_char_p(p), ctypes.c_void_p)
+                _txIovs[i].iov_len = len(p)
+            sent = _sendmmsg(outUdpSocket.fileno(), _txHdrs, n, 0)
+            if sent == n:
+                payloads = payloads[n:]
+                continue
+            logger.warning('sendmmsg to controller computer sent %d of %d',
+                           sent, n)
+            # Retry whatever the kernel did not take, one send() each.
+            payloads = payloads[max(sent, 0):]
+            break
+    for p in payloads:
+        try:
+            outUdpSocket.send(p)
+        except OSError:
+            logger.warning('Send of datagram to controller computer failed')
+
+# Hand-off from the reader threads to the dedicated sender thread, so
+# a momentarily full kernel send buffer stalls only transmission, not
+# reading or parsing. SimpleQueue.put is non-blocking and re-entrant.
+_txQueue = queue.SimpleQueue()
+
+def _udpSenderThread():
+    # Blocks on the queue, then drains whatever else has accumulated
+    # so a burst goes out through one _send_batch call. A None entry
+    # is the shutdown sentinel.
+    while True:
+        payload = _txQueue.get()
+        if payload is None:
+            return
+        batch = [payload]
+        while len(batch) < MAXSENDBATCH:
             try:
-                logger.info("Out depth:  "+msg)
-                outUdpSocket.sendto(msg.encode() , mvpAddr)
-            except:
-                logger.warning('Send of $SDDPT depth datagram to controller computer failed')
-        else:
-            logger.info('zero depth withheld')
+                payload = _txQueue.get_nowait()
+            except queue.Empty:
+                break
+            if payload is None:
+                _send_batch(batch)
+                return
+            batch.append(payload)
+        _send_batch(batch)
+
+def checksum_batch(bodies):
+    # XOR-reduce a list of sentence bodies (the bytes between '$' and
+    # '*') in a single vectorized pass. Only called when numpy is
+    # available and every body is non-empty.
+    flat = np.frombuffer(b''.join(bodies), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(b) for b in bodies[:-1]])
+    return np.bitwise_xor.reduceat(flat, offsets).tolist()
+
+def _process_and_relay(msg):
+    # Timestamp+log a raw incoming message, split it into NMEA
+    # sentences, validate them, and relay the good ones. Runs on the
+    # reader threads so relaying does not wait on the consumer loop.
+    # The payload stays bytes throughout; the only decode is for the
+    # dated display/log line. Returns that line and whether anything
+    # was relayed.
+    datedMsg = _now_ts() + '--' + msg.decode('ascii', 'replace')
+    datedMsg = datedMsg.rstrip()
+    logMessage(datedMsg)
+    # Relay the message if it is of correct format or if it can be
+    # converted to the correct format with minimal tweaking.
+    msgs = msg_split(msg)
+
+    # When a datagram carries a burst of sentences and numpy is
+    # around, compute all their checksums in one vectorized pass.
+    # Sentences that need repair (no ',' after the ID) drop back to
+    # the scalar path inside clean_nmea_str.
+    checkSums = None
+    if np is not None and USECHECKSUMS and len(msgs) >= 4:
+        bodies = []
+        for m in msgs:
+            star = m.find(b'*')
+            if star < 2 or m[6:7] != b',':
+                bodies = None
+                break
+            bodies.append(m[1:star])
+        if bodies is not None:
+            checkSums = checksum_batch(bodies)
+
+    mout = []
+    for i, m in enumerate(msgs):
+        if m[:6] in _DROP_IDS:
+            # Destined for the drop handler; nothing downstream will
+            # look at it, so skip the checksum entirely.
+            continue
+        m, isGoodStr = clean_nmea_str(
+            m, checkSum=None if checkSums is None else checkSums[i])
+        if isGoodStr:
+            mout.append(m)
+    # Hand the outgoing datagrams to the sender thread; it coalesces
+    # the burst into one sendmmsg call where available.
+    for m in mout:
+        payload = relayMessage(m)
+        if payload is not None:
+            _txQueue.put(payload)
+
+    return datedMsg, len(mout) > 0
 
 def msg_split(msg):
-    mout=[]
-    pos2=10
-    if msg[0]=='$':
-        while pos2 > -1:
-            pos = msg.find('$')
-            pos2 = msg[pos+1:].find('$')
-            mout.append(msg[:pos2])
-            msg=msg[pos2+1:]
-    return mout
-
-def clean_nmea_str(nmeaStr):
+    # A datagram can carry more than one NMEA sentence; split on the
+    # leading '$' of each. bytes.split runs in C and is O(n), unlike
+    # the old find()/reslice loop which re-scanned the remainder each
+    # pass.
+    if not msg or msg[:1] != b'$':
+        return []
+    return [b'$' + p for p in msg.split(b'$')[1:] if p]
+
+# Framing for a checksummed sentence: '$', a body free of '*' and
+# line terminators, '*', two hex digits. One compiled match replaces
+# the find()/slice/length/hex-digit checks below it; anything after
+# the two digits is trailing garbage to truncate.
+_NMEA_RE = re.compile(rb'\$([^*\r\n]{1,80})\*([0-9A-Fa-f]{2})')
+
+
+# Two-hex-digit checksum field -> integer value, all case mixes,
+# built once at import. The fallback compare below is then one dict
+# lookup per sentence instead of %-formatting a fresh bytes object
+# (and matches the compiled kernel, which accepts either case).
+_HEX_LUT = {}
+for _i in range(256):
+    _lo = '%02x' % _i
+    _hi = _lo.upper()
+    for _pair in {_lo, _hi, _lo[0] + _hi[1], _hi[0] + _lo[1]}:
+        _HEX_LUT[_pair.encode('ascii')] = _i
+del _i, _lo, _hi, _pair
+
+
+def clean_nmea_str(nmeaStr, checkSum=None):
     # Checks that datagram is of correct NMEA format or can be converted
-    # to the correct format with minimal tweaking.
+    # to the correct format with minimal tweaking. checkSum may carry a
+    # precomputed XOR of the sentence body (see checksum_batch); when
+    # None it is computed here.
     #
     # Returns the cleaned NMEA string and the variable isGoodStr. If
     # isGoodStr is False, then the returned NMEA string will be set
@@ -481,80 +916,94 @@ def clean_nmea_str(nmeaStr):
     # the NMEA string.
     #
     # e.g.,  msg,isGoodStr = clean_nmea_str(msg)
-    logger.debug(f'START CLEAN {nmeaStr}')
     isGoodStr = True
 
     if len(nmeaStr) < 9:
         return nmeaStr, False
 
-    if nmeaStr[6] != ',':
+    if nmeaStr[6:7] != b',':
       nmeaStr = nmeaStr[:6] + nmeaStr[8:]
 
-    logger.debug(f'START CLEAN {nmeaStr}')
     # NMEA string should start with '$'.
-    if isGoodStr == True:
-        if nmeaStr[0] != '$':
-            # Leading '$' is missing, so this string is not valid.
-            isGoodStr = False
+    if nmeaStr[:1] != b'$':
+        # Leading '$' is missing, so this string is not valid.
+        return nmeaStr, False
+
+    # Everything past this point is checksum handling; bail out once
+    # rather than re-testing the same predicate before each block.
+    if not USECHECKSUMS:
+        return nmeaStr, isGoodStr
 
     # If checksums are known to be present, then it should be safe to
     # remove any extra characters following the checksum (such extra
     # characters have been found in garbled NMEA strings; if they are
     # the only problem with the string, removing them will allow us to
-    # salvage the data).
-    if isGoodStr == True and USECHECKSUMS == True:
-        # Split the string into the core string and the checksum string
-        # (following the '*').
-        strs = nmeaStr.split('*')
-
-        if len(strs) < 2:
-            # String does not have an '*', so it is not valid.
-            isGoodStr = False
-        else:
-            coreStr = strs[0]
-            checkSumStr = strs[1][:2]
+    # salvage the data). One compiled match locates the separator,
+    # validates that the checksum field really is two hex digits, and
+    # bounds the body -- the state machine runs in C instead of as a
+    # chain of Python-level find/slice/length checks. A well-formed
+    # sentence passes through with no new allocations at all.
+    reMatch = _NMEA_RE.match(nmeaStr)
+
+    if reMatch is None:
+        # No '$body*hh' frame to be found, so it is not valid.
+        return nmeaStr, False
 
-        # The checksum string should be two digits long.
-        if isGoodStr:
-            #        isGoodStr == True:
-            if len(checkSumStr)<2:
-                # Checksum string is too short, so NMEA string is not valid.
-                # isGoodStr = False
-                isGoodStr = True
-            else:
-                # Truncate the checksum string if it has extra characters
-                # appended to it.
-                checkSumStr = checkSumStr[0:2]
-
-                # Re-assemble the NMEA string with the (possibly) truncated
-                # checksum string.
-                nmeaStr = coreStr + '*' + checkSumStr
-
-    # If requested, check the checksum.
-    if isGoodStr == True and USECHECKSUMS == True:
-
-        # Calculate the checksum. Take the bitwise exclusive OR of zero and
-        # the first character following the leading '$', then the exclusive
-        # OR of the resulting checksum and the second character, and so on.
-        checkSum = 0
-
-        logger.debug(f'core {coreStr} {checkSumStr}')
-        for char in coreStr[1:]:
-            checkSum = checkSum ^ ord(char)
-
-        # If the calculated checksum does not agree with the checksum in the
-        # NMEA string, then the string is not valid.
-        newstr = hex(checkSum)[2:].upper()
-        if newstr != checkSumStr:
+    starIdx = reMatch.end(1)
+    checkSumStr = reMatch.group(2)
+
+    if reMatch.end() != len(nmeaStr):
+        # Extra characters follow the checksum (seen in garbled
+        # strings); truncating them salvages the sentence. Only this
+        # case still allocates a rebuilt string.
+        nmeaStr = nmeaStr[:reMatch.end()]
+
+    # Check the checksum.
+    if checkSum is None and _checksum_valid is not None:
+        # Compiled fast path: XOR and hex compare over the
+        # reassembled sentence in a single C pass, with no
+        # intermediate checksum string.
+        if not _checksum_valid(nmeaStr):
             isGoodStr = False
-            logger.debug(f'bad checksum: >>{newstr}<< >>{checkSumStr}<<')
+            logger.debug('bad checksum: %s', nmeaStr)
+        return nmeaStr, isGoodStr
+
+    # Calculate the checksum: the bitwise exclusive OR of every
+    # character following the leading '$'. The numba kernel (when
+    # available) runs a vectorized loop over a no-copy view of the
+    # body; otherwise reduce() runs the whole XOR at C speed
+    # rather than one interpreted step per character.
+    if checkSum is None:
+        if _nmea_xor is not None:
+            checkSum = int(_nmea_xor(
+                np.frombuffer(nmeaStr, dtype=np.uint8)[1:starIdx]))
         else:
-            logger.debug('good checksum')
+            checkSum = reduce(xor, nmeaStr[1:starIdx], 0)
 
-    logger.debug('STOP CLEAN')
+    # If the calculated checksum does not agree with the checksum in
+    # the NMEA string, then the string is not valid. The LUT maps
+    # the two hex digits straight to an integer (-1 for anything
+    # that is not two hex digits), so the compare is int vs int.
+    if checkSum != _HEX_LUT.get(checkSumStr, -1):
+        isGoodStr = False
+        logger.debug('bad checksum: %02X >>%s<<', checkSum, checkSumStr)
 
     return nmeaStr, isGoodStr
 
+def _clean_nmea_nochecksum(nmeaStr, checkSum=None):
+    # Specialized validator installed when USECHECKSUMS is False:
+    # just the length guard, garble repair and leading-'$' check,
+    # with the whole checksum block (and its per-sentence flag tests)
+    # compiled out rather than branched around.
+    if len(nmeaStr) < 9:
+        return nmeaStr, False
+    if nmeaStr[6:7] != b',':
+        nmeaStr = nmeaStr[:6] + nmeaStr[8:]
+    return nmeaStr, nmeaStr[:1] == b'$'
+
+if not USECHECKSUMS:
+    clean_nmea_str = _clean_nmea_nochecksum
+
 ################################################################
 # Main program.
 ################################################################
@@ -566,10 +1015,20 @@ def clean_nmea_str(nmeaStr):
 logger.info(f'Writing to: {mvpControllerIP}:{udpOutPort}')
 mvpAddr = (mvpControllerIP,udpOutPort)
 outUdpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-logFid = 0
+outUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKETSNDBUF)
+logger.info('SO_SNDBUF granted: %d',
+            outUdpSocket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+# Attach the fixed destination once so the per-message send() skips
+# the per-call address handling that sendto() repeats.
+outUdpSocket.connect(mvpAddr)
+
+# Raw log fd; -1 means no log file open yet.
+logFid = -1
 timeLastLogStarted = float('-inf')
 
+threading.Thread(target=_logFlushThread, daemon=True).start()
+threading.Thread(target=_udpSenderThread, daemon=True).start()
+
 client = ThreadedClient()
 #root.protocol("WM_DELETE_WINDOW", client.endApplication)
 #root.mainloop()
@@ -577,17 +1036,20 @@ client = ThreadedClient()
 try:
     while 1:
         time.sleep(0.1)
-except:
+except KeyboardInterrupt:
     logger.info('killing application')
     client.endApplication()
+    # Unblock the sender thread so it exits cleanly.
+    _txQueue.put(None)
 
 
 # Close outgoing UDP socket.
 try:
     outUdpSocket.close()
-except:
+except OSError:
     pass
 
 # Close log file.
-if logFid != 0:
-    logFid.close()
+if logFid >= 0:
+    flushLog()
+    os.close(logFid)
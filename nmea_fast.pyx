@@ -0,0 +1,52 @@
+# cython: language_level=3
+"""
+Tiny compiled kernel for the hot NMEA checksum loop. Build in place
+with::
+
+    python setup.py build_ext --inplace
+
+(requires Cython). mvp_relay falls back to the pure-Python reduce()
+path when this extension has not been built.
+"""
+
+
+cdef inline int _hexval(unsigned char c):
+    if 48 <= c <= 57:      # '0'..'9'
+        return c - 48
+    if 65 <= c <= 70:      # 'A'..'F'
+        return c - 55
+    if 97 <= c <= 102:     # 'a'..'f'
+        return c - 87
+    return -1
+
+
+def checksum_valid(const unsigned char[:] sentence):
+    # Validate a framed sentence b'$body*HH' in a single C pass:
+    # XOR the body and compare against the two trailing hex digits.
+    # Returns False for anything not shaped like '$...*HH'.
+    cdef Py_ssize_t i, n = sentence.shape[0]
+    cdef unsigned char cs = 0
+    cdef int hi, lo
+    if n < 4 or sentence[0] != 36:      # '$'
+        return False
+    i = 1
+    while i < n and sentence[i] != 42:  # '*'
+        cs ^= sentence[i]
+        i += 1
+    if i != n - 3:
+        return False
+    hi = _hexval(sentence[i + 1])
+    lo = _hexval(sentence[i + 2])
+    if hi < 0 or lo < 0:
+        return False
+    return cs == <unsigned char>((hi << 4) | lo)
+
+
+def xor_checksum(const unsigned char[:] buf):
+    # XOR of every byte in buf, i.e. the NMEA checksum of a sentence
+    # body (the bytes between '$' and '*').
+    cdef Py_ssize_t i, n = buf.shape[0]
+    cdef unsigned char cs = 0
+    for i in range(n):
+        cs ^= buf[i]
+    return cs
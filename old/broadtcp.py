@@ -3,11 +3,21 @@ import time
 HOST = '127.0.0.1'      # Symbolic name meaning the local host
 PORT = 23            # Arbitrary non-privileged port
 
-filen = open('GPS.txt','rb')
-lines = filen.readlines()
+# Sleep per replayed line. Lines are coalesced into buffers of up to
+# BUFSZ bytes and sent with one sendall() per buffer, sleeping
+# proportionally, instead of paying one send() syscall per NMEA line.
+LINEDELAY = 0.01
+BUFSZ = 8192
+
+filen = open('GPS.txt', 'rb')
+blob = filen.read()
+filen.close()
+lines = blob.splitlines(True)
 nlines = len(lines)
-print nlines
+print(nlines)
 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Send buffered chunks immediately rather than letting Nagle hold them.
+s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 s.bind(('', PORT))
 
 
@@ -18,16 +28,21 @@ while 1:
 
     conn, addr = s.accept()
 
-    print 'Connected by', addr
+    print('Connected by', addr)
 
+    buf = bytearray()
+    nbuffered = 0
     while 1:
         try:
-            data = lines[num]
-            num+=1
-            num = num%nlines
-            conn.send(data)
-            time.sleep(0.01)
+            buf += lines[num]
+            nbuffered += 1
+            num += 1
+            num = num % nlines
+            if len(buf) >= BUFSZ or num == 0:
+                conn.sendall(buf)
+                del buf[:]
+                time.sleep(LINEDELAY * nbuffered)
+                nbuffered = 0
         except:
             conn.close()
             break
-            
@@ -24,13 +24,19 @@ http://code.activestate.com/recipes/82965/.
 
 """
 
-from Tkinter import *
+from tkinter import *
+import io
 import time
 import threading
-import Queue
+import queue
 import serial
 import socket
 import math
+import operator
+import re
+import select
+from collections import deque
+from functools import reduce
 
 ################################################################
 # These constants can be changed to alter program behaviour:
@@ -52,12 +58,19 @@ udpOutPort = 2021
 #udpInPorts = [21567, 21568]
 #udpInPorts = [21567]
 udpInPorts = [23]
-print 'hello'
-
 # Additional UDP parameters:
 udpInBufferLength = 1024 # [bytes]
 UDPTIMEOUT = 1 # [seconds]
 
+# Kernel socket buffer sizes; kernels silently cap these to the
+# rmem_max/wmem_max sysctls, so the granted sizes are printed.
+SOCKETRCVBUF = 1 << 20 # [bytes]
+SOCKETSNDBUF = 1 << 20 # [bytes]
+
+# Maximum number of extra datagrams drained from a socket without
+# blocking after each successful receive.
+MAXRECVBURST = 32
+
 # TCP parameters:
 tcpInPorts = [50008]
 tcpAddresses = ['127.0.0.1']
@@ -136,6 +149,10 @@ dataTextHeight = 12 # (text windows height in lines of text)
 # will be blank space in display.
 NUMTEXTROWS = 14
 
+# Cap on messages drained from the queues per processIncoming call,
+# so a heavy burst cannot starve the Tk event loop.
+MAXDRAINPERCALL = 64
+
 # Calculate checksums of NMEA strings. Will only relay datagrams
 # to MVP controller if they are valid strings with the correct
 # checksum. Set this constant to False if the navigation datagrams
@@ -146,6 +163,12 @@ NUMTEXTROWS = 14
 USECHECKSUMS = FALSE
 
 ################################################################
+
+# Map ASCII control characters (0-31) and non-ASCII characters
+# (128-255) to question marks for display in GUI. Built once at import
+# so translate() runs its C loop with no per-instance table setup.
+_ASCII_TABLE = {i: "?" for i in list(range(32)) + list(range(128, 256))}
+
 class FIFOTextStack:
 
     """    
@@ -156,43 +179,27 @@ class FIFOTextStack:
     #****************
     def __init__(self,numRows):
         self.numRows = numRows
-        self.textList = []
 
-        # Map ASCII control characters (0-31) and non-ASCII characters
-        # (129-255) to question marks for display in GUI.
-        #self.asciiCharTable = "".join(map(chr,range(128))) + "?"*128
-        #self.asciiCharTable = "?"*256
-        self.asciiCharTable = "?"*32 + "".join(map(chr,range(32,128))) + "?"*128
+        # A deque with maxlen discards the oldest line automatically,
+        # so push is O(1) instead of copying the retained window on
+        # every overflow.
+        self.textList = deque(maxlen=numRows)
 
     #****************
     def push(self,newTextLine):
         # Pushes a new line onto the end of the stack. If stack
         # exceeds specified length, then the first line of the
-        # stack is discarded.
+        # stack is discarded (handled by the deque's maxlen).
 
-        # Convert any ASCII control characters and non-ASCII characters to 
+        # Convert any ASCII control characters and non-ASCII characters to
         # question marks before putting them on the stack.
-        newTextLine = newTextLine.translate(self.asciiCharTable)
+        newTextLine = newTextLine.translate(_ASCII_TABLE)
         self.textList.append(newTextLine)
 
-        if len(self.textList) > self.numRows:
-            self.textList = self.textList[1:]
-
     #****************
     def outputString(self):
         # Outputs multi-line string, suitable for use in Tk Label object.
-        outStr = ''
-        iLine = 0
-
-        for thisLine in self.textList:
-            outStr = outStr + thisLine
-            iLine = iLine + 1
-
-            # Add newline character (except for last line).
-            if iLine < self.numRows:
-                outStr = outStr + '\n'
-
-        return outStr          
+        return '\n'.join(self.textList)
 
 ################################################################
 class GuiPart:
@@ -212,6 +219,12 @@ class GuiPart:
         # Make FIFO text stack to contain lines of serial data.
         self.serialTextStack = FIFOTextStack(NUMTEXTROWS)
 
+        # Last text handed to each Label; configure() forces a full Tk
+        # relayout, so it is skipped when the text has not changed.
+        self.lastSerialText = None
+        self.lastUdpText = None
+        self.lastWarnStr = None
+
         # Set up the GUI
         #console = Tkinter.Button(master, text='Done', command=endCommand)
         #console.pack()
@@ -302,82 +315,76 @@ class GuiPart:
         # Warn user if no depth datagrams have been sent in the specified
         # timeout period.
 
+        # One clock read per drain pass; it is reused for the timeout
+        # arithmetic below and by every logMessage call in this pass.
+        now = time.time()
+
         # ..Determine number of seconds since last depth was relayed.
-        self.secondsSinceLastDepth = time.time() - self.lastDepthEpochTime
+        self.secondsSinceLastDepth = now - self.lastDepthEpochTime
         
         if self.secondsSinceLastDepth >= self.depthTimeOutSeconds: 
             
             # It has been more than depthTimeOutSeconds since the last
             # depth was relayed to the MVP controller. Warn the operator.
             #self.depthWarningWindow.showDepthWarning()    
-            secondsSinceLastWarningClosed = time.time() - self.lastDepthCloseTime
+            secondsSinceLastWarningClosed = now - self.lastDepthCloseTime
 
             if secondsSinceLastWarningClosed > TIMEBETWEENWARNINGS:
                 self.depthWarningWindow.showDepthWarning()    
 
-        serialQueueSize = self.serialQueue.qsize()
-        udpQueueSize = self.udpQueue.qsize()
-
-        while serialQueueSize > 0 or udpQueueSize > 0:
-            serialQueueSize = self.serialQueue.qsize()
-            udpQueueSize = self.udpQueue.qsize()
-
-            getFailed = False
-            
+        # One timestamp per drain pass; a burst of queued messages all
+        # arrived within the same tick, so there is no need to pay a
+        # strftime/localtime call per message.
+        ts = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime())
+
+        # Drain each queue with get_nowait until it is empty. The
+        # worker threads have already cleaned and relayed these
+        # messages; all that is left here is logging and display. No
+        # qsize() polling (every call takes the queue mutex) and
+        # queue.Empty is caught specifically so real errors are not
+        # swallowed. The drain is capped per call so a heavy burst
+        # cannot starve the Tk event loop.
+        drained = 0
+
+        while drained < MAXDRAINPERCALL:
             try:
-                msg = self.serialQueue.get(0)
-            except:
-                # Was "except Queue.Empty", but want to catch any error, not
-                # just Queue.Empty.
-                getFailed = True
-                
-            if getFailed == False:
-                # Log the message without modification, apart from adding
-                # a timestamp.
-                datedMsg = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()) + '--' + msg
-                datedMsg = datedMsg.rstrip()
-                logMessage(datedMsg) 
-                self.serialTextStack.push(datedMsg)                
-                outputStr = self.serialTextStack.outputString()
-                self.serialLabel.configure(text=outputStr)
-
-                # Relay the message if it is of correct format or if it can be
-                # converted to the correct format with minimal tweaking.
-                
-                msg,isGoodStr = clean_nmea_str(msg)
-                if isGoodStr:
-                    relayMessage(msg,self)                    
-
-            getFailed = False
-
+                msg = self.serialQueue.get_nowait()
+            except queue.Empty:
+                break
+            drained = drained + 1
+
+            # Log the message without modification, apart from adding
+            # a timestamp. Single join instead of a +-chain plus a
+            # separate rstrip copy.
+            datedMsg = ''.join((ts, '--', msg.rstrip()))
+            logMessage(datedMsg, now)
+            self.serialTextStack.push(datedMsg)
+
+        # One redraw per drain pass, and only if the text changed; a
+        # burst of N messages costs one relayout instead of N.
+        outputStr = self.serialTextStack.outputString()
+        if outputStr != self.lastSerialText:
+            self.serialLabel.configure(text=outputStr)
+            self.lastSerialText = outputStr
+
+        while drained < MAXDRAINPERCALL:
             try:
-                msg = self.udpQueue.get(0)
-            except:
-                # Was "except Queue.Empty", but want to catch any error, not
-                # just Queue.Empty.
-                getFailed = True
-
-            if getFailed == False:
-                # Log the message without modification, apart from adding
-                # a timestamp.
-                datedMsg = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()) + '--' + msg
-                datedMsg = datedMsg.rstrip()
-                logMessage(datedMsg) 
-                self.udpTextStack.push(datedMsg)                
-                outputStr = self.udpTextStack.outputString()
-                self.udpLabel.configure(text=outputStr)
-
-                # Relay the message if it is of correct format or if it can be
-                # converted to the correct format with minimal tweaking.
-                #print 'boo' + msg
-                msg,isGoodStr = clean_nmea_str(msg)
-                #print 'boo' + msg
-                
-                #isGoodStr = nmea_checksum(msg)
-
-                # Relay the message if it is of correct format.
-                if isGoodStr:
-                    relayMessage(msg,self)
+                msg = self.udpQueue.get_nowait()
+            except queue.Empty:
+                break
+            drained = drained + 1
+
+            # Log the message without modification, apart from adding
+            # a timestamp. Single join instead of a +-chain plus a
+            # separate rstrip copy.
+            datedMsg = ''.join((ts, '--', msg.rstrip()))
+            logMessage(datedMsg, now)
+            self.udpTextStack.push(datedMsg)
+
+        outputStr = self.udpTextStack.outputString()
+        if outputStr != self.lastUdpText:
+            self.udpLabel.configure(text=outputStr)
+            self.lastUdpText = outputStr
                     
     def depthTimeOutSecondsEntryCallback(self,depthTimeOutSecondsEntry):
         # Callback for abort threshold entry box.
@@ -388,7 +395,7 @@ class GuiPart:
         # it is a valid entry.
         try:
             newDepthTimeOutSeconds = float(depthTimeOutSecondsStr)
-        except:
+        except ValueError:
             # Revert to previous timeout value.
             newDepthTimeOutSeconds = self.depthTimeOutSeconds
 
@@ -422,10 +429,17 @@ class GuiPart:
 
     def setWarningLabel(self):
         # Sets the warning label in the depth timeout warning dialogue.        
-        warnStr = 'The stream of depth values relayed \n to the MVP controller ' + \
-                  'was interrupted for more than ' + str(self.depthTimeOutSeconds) + ' seconds.\n' + \
-            ' The MVP profile may have been aborted. \n\n' + \
-            'Set depth timeout to "inf" to disable this warning.'  
+        warnStr = ('The stream of depth values relayed \n to the MVP '
+                   'controller was interrupted for more than %s seconds.\n'
+                   ' The MVP profile may have been aborted. \n\n'
+                   'Set depth timeout to "inf" to disable this warning.'
+                   % self.depthTimeOutSeconds)
+
+        # Skip the relayout when the warning is re-issued unchanged
+        # (it is rebuilt on every timeout callback).
+        if warnStr == self.lastWarnStr:
+            return
+        self.lastWarnStr = warnStr
         self.depthWarningWindow.warnLabel.configure(text=warnStr)
 
 
@@ -477,8 +491,11 @@ class DepthWarningWindow(Toplevel):
 
         # Apparent bug in tkinter causes lift() to fail to raise
         # warning dialogue to top of window stack. Workaround by
-        # "refreshing" dialogue box periodically.
-        if secondsSinceLastRefresh > WD_REFRESHINTERVALSECONDS:
+        # "refreshing" dialogue box periodically -- but only when the
+        # window manager actually needs the nudge; if the dialogue is
+        # already mapped normally, the flicker is pure cost.
+        if (secondsSinceLastRefresh > WD_REFRESHINTERVALSECONDS and
+                self.wm_state() != 'normal'):
             self.bell()
             self.withdraw()
             self.deiconify()
@@ -519,8 +536,8 @@ class ThreadedClient:
         self.master = master
 
         # Create the queues.
-        self.serialQueue = Queue.Queue()
-        self.udpQueue = Queue.Queue()
+        self.serialQueue = queue.Queue()
+        self.udpQueue = queue.Queue()
 
         # Set up the GUI part
         self.gui = GuiPart(master, self.serialQueue, self.udpQueue, self.endApplication)
@@ -535,21 +552,29 @@ class ThreadedClient:
                 threading.Thread(target=self.serialThread, args=(serialInPort,))
             self.serialRelayThreads[serialInPort].start()
 
-        # Start thread(s) for relaying UDP data to MVP controller.
-        self.udpRelayThreads = {} # (dictionary variable)
+        # Start a single thread relaying UDP data from every incoming
+        # port to the MVP controller.
+        self.udpRelayThread = threading.Thread(target=self.udpThread)
+        self.udpRelayThread.start()
 
-        for udpInPort in udpInPorts:
-            self.udpRelayThreads[udpInPort] = \
-                threading.Thread(target=self.udpThread, args=(udpInPort,))
-            self.udpRelayThreads[udpInPort].start()
+        # Worker threads raise <<MvpData>> after enqueuing, so the
+        # queues are drained on arrival instead of on a fixed poll.
+        master.bind("<<MvpData>>", self.dataArrived)
 
-        # Start the periodic call in the GUI to check if the queue contains
-        # anything
+        # Start the safety tick (depth-timeout warning and shutdown).
         self.periodicCall()
 
+    def dataArrived(self, event):
+        # Bound to <<MvpData>>: drain as soon as a worker enqueues.
+        self.gui.processIncoming()
+        flushSends()
+
     def periodicCall(self):
         """
-        Check every 100 ms if there is something new in the queue.
+        Once-a-second safety tick. Normal draining happens in
+        dataArrived when data lands; this tick keeps the depth-timeout
+        warning working when no data arrives at all, and handles
+        shutdown.
         """
         self.gui.processIncoming()
 
@@ -559,14 +584,19 @@ class ThreadedClient:
             for serialInPort in self.serialRelayThreads.keys():
                 self.serialRelayThreads[serialInPort].join()
             
-            # Wait for UDP thread(s) to complete.
-            for udpInPort in self.udpRelayThreads.keys():
-                self.udpRelayThreads[udpInPort].join()
+            # Wait for the UDP thread to complete.
+            self.udpRelayThread.join()
             
             import sys
             sys.exit(1)
             
-        self.master.after(200, self.periodicCall)
+        # Push out anything relayMessage buffered during this tick and
+        # sync the buffered log file to the kernel.
+        flushSends()
+        if logFid != 0:
+            logFid.flush()
+
+        self.master.after(1000, self.periodicCall)
 
     def serialThread(self,serialInPort):
         #print 'serialInPort is ' + str(serialInPort)
@@ -578,8 +608,14 @@ class ThreadedClient:
                                     stopbits=stopBits,timeout=timeOut,\
                                     xonxoff=xonxoff,rtscts=rtscts,\
                                     interCharTimeout=interCharTimeout)
-        except:
-            print 'Failed to open serial port'
+        except serial.SerialException:
+            print('Failed to open serial port')
+            return
+
+        # pyserial implements the raw-IO interface, so a BufferedReader
+        # on top turns a burst of lines into one read syscall per
+        # buffer refill instead of one per line.
+        serialReader = io.BufferedReader(self.ser, 4096)
 
         while self.running:
 
@@ -587,69 +623,131 @@ class ThreadedClient:
             serialData = ''
 
             try:
-                serialData = self.ser.readline()
-                print serialData
-            except:
+                serialData = serialReader.readline().decode('ascii', 'replace')
+            except serial.SerialException:
                 pass
 
             # If serial connection timed out, then serialData will be empty.
             if len(serialData) > 0:
+                # Clean and relay here, in the source thread, so the
+                # outbound datagram does not wait on the Tk event
+                # loop; the queue only carries the line for display.
+                cleanMsg,isGoodStr = clean_nmea_str(serialData)
+                if isGoodStr:
+                    relayMessage(cleanMsg,self.gui)
+                flushSends()
+
                 self.serialQueue.put(serialData)
 
+                # Wake the GUI thread; event_generate is one of the
+                # few Tk calls that is safe from a worker thread.
+                try:
+                    self.master.event_generate("<<MvpData>>", when="tail")
+                except TclError:
+                    pass
+
         # Close incoming serial connection.
         try:
             self.ser.close()
-        except:
+        except (serial.SerialException, socket.error, OSError):
             pass
 
-    def udpThread(self,udpInPort):
-        print 'udpInPort is ' + str(udpInPort)
-
-        # Create socket for listening to incoming UDP data.
+    def udpThread(self):
+        # One thread and one select() call service every incoming UDP
+        # port, instead of a blocking-recv thread per port. (select
+        # cannot wait on Windows serial handles, so the serial ports
+        # keep their per-port threads.)
         relayIP = '' # (Symbolic name meaning the local host)
-        relayAddr = (relayIP,udpInPort)
-        print relayAddr
-        inUdpSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        inUdpSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        inUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        inUdpSocket.settimeout(UDPTIMEOUT)
-        # ...Bind incoming UDP socket to address of local machine.
-        inUdpSocket.bind(relayAddr)
-
-        while self.running:
-            # Read in data from network.
-            udpData = ''
+        inUdpSockets = []
 
+        for udpInPort in udpInPorts:
+            print('udpInPort is ' + str(udpInPort))
+            relayAddr = (relayIP,udpInPort)
+            print(relayAddr)
+            inUdpSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+            inUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+            # A large receive buffer keeps bursty depthsounder traffic
+            # from being dropped by the kernel before we drain it. The
+            # kernel caps the size silently, so report what was granted.
+            inUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKETRCVBUF)
+            print('SO_RCVBUF granted: ' +
+                  str(inUdpSocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+
+            # Nonblocking: select() says when a socket is readable and
+            # the burst drain below stops on EWOULDBLOCK.
+            inUdpSocket.setblocking(0)
+            # ...Bind incoming UDP socket to address of local machine.
+            inUdpSocket.bind(relayAddr)
+            inUdpSockets.append(inUdpSocket)
+
+        # One receive buffer reused for every datagram; recv_into
+        # writes into it in place, so the only per-packet allocation
+        # is the (short) sentence string handed downstream, not a
+        # fresh 1024-byte recv buffer each time.
+        rxBuf = bytearray(udpInBufferLength)
+
+        while self.running and len(inUdpSockets) > 0:
+            readable = select.select(inUdpSockets, [], [], UDPTIMEOUT)[0]
+
+            gotData = False
+            for inUdpSocket in readable:
+                # Drain the datagrams the kernel has queued on this
+                # socket, so a burst costs one select() wakeup (and
+                # one GUI wakeup) rather than one per datagram.
+                for iBurst in range(MAXRECVBURST):
+                    try:
+                        nRead = inUdpSocket.recv_into(rxBuf)
+                    except socket.error:
+                        break
+                    if nRead == 0:
+                        break
+                    udpData = rxBuf[:nRead].decode('ascii', 'replace')
+
+                    # Clean and relay in this thread so the outbound
+                    # datagram does not wait on the Tk event loop; the
+                    # queue only carries the line for display.
+                    cleanMsg,isGoodStr = clean_nmea_str(udpData)
+                    if isGoodStr:
+                        relayMessage(cleanMsg,self.gui)
+
+                    self.udpQueue.put(udpData)
+                    gotData = True
+
+            if gotData:
+                # Push the whole burst to the controller at once.
+                flushSends()
+
+                # Wake the GUI thread; event_generate is one of the
+                # few Tk calls that is safe from a worker thread.
+                try:
+                    self.master.event_generate("<<MvpData>>", when="tail")
+                except TclError:
+                    pass
+
+        # Close incoming UDP socket(s).
+        for inUdpSocket in inUdpSockets:
             try:
-                udpData = inUdpSocket.recv(udpInBufferLength)
-            except:
+                inUdpSocket.close()
+            except socket.error:
                 pass
 
-            # If UDP connection timed out, then udpData will be empty.
-            if len(udpData) > 0:
-
-                # udpData is not empty; echo datagram to GUI.
-                self.udpQueue.put(udpData)
-
-        # Close incoming UDP socket.        
-        try:
-            inUdpSocket.close()
-        except:
-            pass
-
 
     def endApplication(self):
         self.running = 0
 
 
-def logMessage(msg):
+def logMessage(msg, now=None):
 
     global logFid, timeLastLogStarted
 
+    if now is None:
+        now = time.time()
+
     # Create new log file if necessary.
 
     # ...Check if time to create new log file.
-    secondsSinceLastNewLog = time.time() - timeLastLogStarted
+    secondsSinceLastNewLog = now - timeLastLogStarted
 
     if secondsSinceLastNewLog > MINUTES_PER_LOG*60:
         # Close existing log file.
@@ -660,91 +758,104 @@ def logMessage(msg):
         # in them (e.g., 'mvp_relay_20081015164302.log').
         nowStr = time.strftime("%Y%m%d%H%M%S",time.localtime())
         newLogName = 'mvp_relay_' + nowStr + '.log'
-        logFid = open(newLogName,'w')
-        timeLastLogStarted = time.time()
+        # Large buffer; lines are coalesced in userspace and pushed to
+        # the kernel by the once-a-second flush in periodicCall (and on
+        # rotation above) rather than with a write+flush per sentence.
+        logFid = open(newLogName,'w', buffering=65536)
+        timeLastLogStarted = now
 
-    msg = msg + '\n'
+    # Two buffered writes avoid the msg+'\n' intermediate copy.
     logFid.write(msg)
-    logFid.flush()
+    logFid.write('\n')
+
+# Outgoing sentences are coalesced into a small buffer and sent as a
+# single datagram, either when the buffer grows past SENDBUFFLUSHBYTES
+# or on the next periodicCall tick, instead of paying one sendto()
+# per sentence. The controller parses newline-delimited sentences, so
+# packing several per datagram is fine.
+SENDBUFFLUSHBYTES = 8192
+
+_sendBuf = []
+_sendBufBytes = 0
+# Serial threads, the UDP thread and the Tk thread all relay now, so
+# the shared buffer needs a lock. The send itself happens outside it.
+_sendLock = threading.Lock()
+
+def _enqueueSend(msg):
+    global _sendBufBytes
+    with _sendLock:
+        _sendBuf.append(msg)
+        _sendBufBytes = _sendBufBytes + len(msg)
+        doFlush = _sendBufBytes >= SENDBUFFLUSHBYTES
+    if doFlush:
+        flushSends()
+
+def flushSends():
+    global _sendBufBytes
+    with _sendLock:
+        if len(_sendBuf) == 0:
+            return
+        payload = ''.join(_sendBuf)
+        del _sendBuf[:]
+        _sendBufBytes = 0
+    try:
+        # The socket is connect()ed to the controller at startup, so
+        # send() skips the per-packet sockaddr copy and route lookup
+        # that sendto() repeats on every call. NMEA is 7-bit ASCII,
+        # so the encode never fails.
+        outUdpSocket.send(payload.encode('ascii', 'replace'))
+    except socket.error:
+        print('Send of datagrams to controller computer failed')
+# Field index holding the depth value for each single-depth NMEA
+# format. One dict lookup replaces the old if/elif chain of string
+# compares, and it also routes $FKDBS to its zero-depth filter, which
+# the old depth-datagram test left out (so $FKDBS used to fall through
+# to the pass-through branch unfiltered).
+_DEPTH_FIELD = {"$SDDBS": 3, "$FKDBS": 4, "$PKEL9": 5}
 
 def relayMessage(msg,gui):
 
-    # Determine if this is a depth datagram or not.
-    fields = msg.split(',')
-    nmeaID = fields[0]
-
-    #print nmeaID
-    if nmeaID == "$FKDBS":
-        print msg
-    if nmeaID == "$SDDBS" or nmeaID == "$SDDPT" or nmeaID =='$PKEL9':
-        isDepthDataGram = 1
-    else:
-        isDepthDataGram = 0
-    #print msg
-    #print nmeaID
-    #print fields[1]
     if len(msg) == 0:
         # Do not send empty datagrams.
-        pass
-    elif isDepthDataGram == 0:
+        return
 
-        # Datagram is not a depth datagram.
-        try:
-#            print msg
-            #outUdpSocket.sendto(msg.strip(),mvpAddr)
-            outUdpSocket.sendto(msg.strip()+'\n',mvpAddr)
-        except:
-            print 'Send of non-depth datagram to controller computer failed'
-
-    elif nmeaID == "$PKEL9":
-        depthStr = fields[5]
-        depth = float(depthStr)
-        #print depth
-        print msg
-        if depth != 0:
-            # Depth value is not zero, so it will be relayed to
-            # MVP controller. Record the time of this event.
-            gui.lastDepthEpochTime = time.time()
+    # Identify the sentence from its leading characters; no need to
+    # split every field just to read the ID.
+    nmeaID = msg.split(',', 1)[0]
 
-            # Relay message to MVP controller.
-            try:
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print 'Send of $SDDBS datagram to controller computer failed'
+    depthField = _DEPTH_FIELD.get(nmeaID)
 
-        
-    elif nmeaID == "$SDDBS":
+    if depthField is not None:
 
-        # Datagram is a depth datagram of "$SDDBS" format. This is the
-        # format output by the Tully's Simrad ER60 multi-frequency
-        # echosounder (we usually use the 18-kHz channel). The ER60
+        # Datagram carries a single depth value. $SDDBS is the format
+        # output by the Tully's Simrad ER60 multi-frequency
+        # echosounder (we usually use the 18-kHz channel), with $FKDBS
+        # and $PKEL9 as variants from other sounders. The ER60
         # outputs a zero-depth datagram whenever it cannot find the
         # bottom, which causes the MVP controller to abort the cast,
         # believing the water depth to be too shallow. Avoid this
         # problem by checking that the datagram does not contain a
         # zero depth before relaying it to the MVP controller.
 
-        # ...Determine depth from echosounder message.
-        depthStr = fields[3]
-        depth = float(depthStr)
+        # ...Determine depth from echosounder message. maxsplit stops
+        # the split at the field we need; slice off a trailing
+        # '*checksum' if the depth happens to be the last field.
+        fields = msg.split(',', depthField + 1)
 
-        if depth != 0:
-            # Depth value is not zero, so it will be relayed to
-            # MVP controller. Record the time of this event.
-            gui.lastDepthEpochTime = time.time()
+        if len(fields) <= depthField:
+            print('Too few fields in ' + nmeaID + ' datagram')
+            return
 
-            # Relay message to MVP controller.
-            try:
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print 'Send of $SDDBS datagram to controller computer failed'
+        depthStr = fields[depthField]
+        starPos = depthStr.find('*')
+        if starPos >= 0:
+            depthStr = depthStr[:starPos]
 
-    elif nmeaID == "$FKDBS":
-
-        # ...Determine depth from echosounder message.
-        depthStr = fields[4]
-        depth = float(depthStr)
-        print depth
+        try:
+            depth = float(depthStr)
+        except ValueError:
+            print('Bad depth field in ' + nmeaID + ' datagram')
+            return
 
         if depth != 0:
             # Depth value is not zero, so it will be relayed to
@@ -752,11 +863,9 @@ def relayMessage(msg,gui):
             gui.lastDepthEpochTime = time.time()
 
             # Relay message to MVP controller.
-            try:
-                outUdpSocket.sendto(msg,mvpAddr)
-            except:
-                print 'Send of $FKDBS datagram to controller computer failed'
-    else:
+            _enqueueSend(msg.strip() + '\n')
+
+    elif nmeaID == "$SDDPT":
 
         # Datagram is a depth datagram, but of $SDDPT format. This is
         # the type of NMEA string that comes from the EA600
@@ -772,25 +881,45 @@ def relayMessage(msg,gui):
         # with zero depths being sent to the MVP controller, causing
         # profiles to be aborted. Not sure if the MVP software is using
         # the depth below the transducer or the true depth, so test for
-        # zeroes in both.
+        # zeroes in both. Only fields 1 and 2 are needed, so stop the
+        # split there.
+        fields = msg.split(',', 3)
+
+        if len(fields) < 3:
+            print('Too few fields in $SDDPT datagram')
+            return
+
         depthStr = fields[1]
         offsetStr = fields[2]
-        depthBelowT = float(depthStr)
-        depthBelowS = depthBelowT + float(offsetStr)
+        starPos = offsetStr.find('*')
+        if starPos >= 0:
+            offsetStr = offsetStr[:starPos]
+        try:
+            depthBelowT = float(depthStr)
+            depthBelowS = depthBelowT + float(offsetStr)
+        except ValueError:
+            print('Bad depth field in $SDDPT datagram')
+            return
 
         # ...Relay message to MVP controller.
         msg = msg.strip() + '\n'
-        #outUdpSocket.sendto(msg,mvpAddr)
-        #gui.lastDepthEpochTime = time.time()
 
         if depthBelowT != 0 and depthBelowS != 0:
-            try:
-                outUdpSocket.sendto(msg,mvpAddr)
-                gui.lastDepthEpochTime = time.time()
-            except:
-                print 'Send of $SDDPT depth datagram to controller computer failed'
+            gui.lastDepthEpochTime = time.time()
+            _enqueueSend(msg)
         else:
-            print 'zero depth withheld'
+            print('zero depth withheld')
+    else:
+
+        # Datagram is not a depth datagram.
+        _enqueueSend(msg.strip()+'\n')
+
+# Framing check for the head of a sentence: '$', a five-character
+# talker/sentence ID, then the first comma. Compiled once so the
+# per-message check is a single C-level match instead of several
+# Python-level index comparisons.
+_NMEA_HEAD = re.compile(r'\$[A-Z0-9]{5},')
+
 
 def clean_nmea_str(nmeaStr):
     # Checks that datagram is of correct NMEA format or can be converted
@@ -807,17 +936,18 @@ def clean_nmea_str(nmeaStr):
     # e.g.,  msg,isGoodStr = clean_nmea_str(msg)
     isGoodStr = True
 
-    if len(nmeaStr) < 2:
+    if len(nmeaStr) < 9:
+        # Too short to hold '$ID...*hh'; also protects the repair
+        # slice below from indexing past the end.
         isGoodStr = False
-
-#    print 'boo3' + nmeaStr
-    if nmeaStr[6] != ',':
-      nmeaStr = nmeaStr[:6] + nmeaStr[8:]
-    #print nmeaStr      
-    # NMEA string should start with '$'.
-    if isGoodStr == True:
-        if nmeaStr[0] != '$':
-            # Leading '$' is missing, so this string is not valid.
+    else:
+        # A known garble inserts two extra characters after the
+        # sentence ID; splice them out before checking the framing.
+        if nmeaStr[6] != ',':
+            nmeaStr = nmeaStr[:6] + nmeaStr[8:]
+        if _NMEA_HEAD.match(nmeaStr) is None:
+            # Head is not '$' + five-character ID + ',', so this
+            # string is not valid.
             isGoodStr = False
     
     # If checksums are known to be present, then it should be safe to
@@ -825,7 +955,7 @@ def clean_nmea_str(nmeaStr):
     # characters have been found in garbled NMEA strings; if they are
     # the only problem with the string, removing them will allow us to
     # salvage the data).
-    if isGoodStr == True and USECHECKSUMS == True:
+    if isGoodStr and USECHECKSUMS:
         # Split the string into the core string and the checksum string
         # (following the '*').
         strs = nmeaStr.split('*')
@@ -838,7 +968,7 @@ def clean_nmea_str(nmeaStr):
             checkSumStr = strs[1]
         
         # The checksum string should be two digits long.
-        if isGoodStr == True:
+        if isGoodStr:
             if len(checkSumStr)<2:
                 # Checksum string is too short, so NMEA string is not valid.
                 # isGoodStr = False
@@ -853,20 +983,18 @@ def clean_nmea_str(nmeaStr):
                 nmeaStr = coreStr + '*' + checkSumStr
 
     # If requested, check the checksum.
-    if isGoodStr == True and USECHECKSUMS == True:
-
-        # Calculate the checksum. Take the bitwise exclusive OR of zero and
-        # the first character following the leading '$', then the exclusive
-        # OR of the resulting checksum and the second character, and so on.
-        checkSum = 0
+    if isGoodStr and USECHECKSUMS:
 
-        for char in coreStr[1:]:
-            checkSum = checkSum ^ ord(char)
+        # Calculate the checksum: the bitwise exclusive OR of every
+        # character following the leading '$'. bytearray yields the
+        # character codes directly and reduce runs the XOR fold in C,
+        # replacing a Python-level loop with an ord() call per byte.
+        checkSum = reduce(operator.xor, bytearray(coreStr[1:], 'ascii', 'replace'), 0)
 
         # Convert checksum string from hex to decimal.
         try:
             intCheckSum = int(checkSumStr,16)
-        except:
+        except ValueError:
             # Conversion of checksum string to integer has
             # failed, probably because of unexpected control 
             # characters. Use a dummy (bad) value of the
@@ -891,6 +1019,12 @@ def clean_nmea_str(nmeaStr):
 # for both echosounder data and GPS data.
 mvpAddr = (mvpControllerIP,udpOutPort)
 outUdpSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+outUdpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKETSNDBUF)
+# Fix the destination once; flushSends can then use send() rather
+# than sendto() with the address every time.
+outUdpSocket.connect(mvpAddr)
+print('SO_SNDBUF granted: ' +
+      str(outUdpSocket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)))
 
 logFid = 0
 timeLastLogStarted = float('-inf')
@@ -903,7 +1037,7 @@ root.mainloop()
 # Close outgoing UDP socket.
 try:
     outUdpSocket.close()                               
-except:
+except socket.error:
     pass
 
 # Close log file.
@@ -30,6 +30,7 @@ import threading
 import Queue
 import socket
 import math
+from collections import deque
 
 doSerial=False
 ################################################################
@@ -158,7 +159,11 @@ class FIFOTextStack:
     #****************
     def __init__(self,numRows):
         self.numRows = numRows
-        self.textList = []
+
+        # A deque with maxlen discards the oldest line automatically,
+        # so push is O(1) instead of copying the retained window on
+        # every overflow.
+        self.textList = deque(maxlen=numRows)
 
         # Map ASCII control characters (0-31) and non-ASCII characters
         # (129-255) to question marks for display in GUI.
@@ -170,31 +175,17 @@ class FIFOTextStack:
     def push(self,newTextLine):
         # Pushes a new line onto the end of the stack. If stack
         # exceeds specified length, then the first line of the
-        # stack is discarded.
+        # stack is discarded (handled by the deque's maxlen).
 
         # Convert any ASCII control characters and non-ASCII characters to 
         # question marks before putting them on the stack.
         newTextLine = newTextLine.translate(self.asciiCharTable)
         self.textList.append(newTextLine)
 
-        if len(self.textList) > self.numRows:
-            self.textList = self.textList[1:]
-
     #****************
     def outputString(self):
         # Outputs multi-line string, suitable for use in Tk Label object.
-        outStr = ''
-        iLine = 0
-
-        for thisLine in self.textList:
-            outStr = outStr + thisLine
-            iLine = iLine + 1
-
-            # Add newline character (except for last line).
-            if iLine < self.numRows:
-                outStr = outStr + '\n'
-
-        return outStr          
+        return '\n'.join(self.textList)
 
 ################################################################
 class GuiPart:
@@ -333,7 +324,7 @@ class GuiPart:
                 # just Queue.Empty.
                 getFailed = True
                 
-            if getFailed == False:
+            if not getFailed:
                 # Log the message without modification, apart from adding
                 # a timestamp.
                 datedMsg = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()) + '--' + msg
@@ -359,7 +350,7 @@ class GuiPart:
                 # just Queue.Empty.
                 getFailed = True
 
-            if getFailed == False:
+            if not getFailed:
                 # Log the message without modification, apart from adding
                 # a timestamp.
                 datedMsg = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime()) + '--' + msg
@@ -815,7 +806,7 @@ def clean_nmea_str(nmeaStr):
       nmeaStr = nmeaStr[:6] + nmeaStr[8:]
     #print nmeaStr      
     # NMEA string should start with '$'.
-    if isGoodStr == True:
+    if isGoodStr:
         if nmeaStr[0] != '$':
             # Leading '$' is missing, so this string is not valid.
             isGoodStr = False
@@ -825,7 +816,7 @@ def clean_nmea_str(nmeaStr):
     # characters have been found in garbled NMEA strings; if they are
     # the only problem with the string, removing them will allow us to
     # salvage the data).
-    if isGoodStr == True and USECHECKSUMS == True:
+    if isGoodStr and USECHECKSUMS:
         # Split the string into the core string and the checksum string
         # (following the '*').
         strs = nmeaStr.split('*')
@@ -838,7 +829,7 @@ def clean_nmea_str(nmeaStr):
             checkSumStr = strs[1]
         
         # The checksum string should be two digits long.
-        if isGoodStr == True:
+        if isGoodStr:
             if len(checkSumStr)<2:
                 # Checksum string is too short, so NMEA string is not valid.
                 # isGoodStr = False
@@ -853,7 +844,7 @@ def clean_nmea_str(nmeaStr):
                 nmeaStr = coreStr + '*' + checkSumStr
 
     # If requested, check the checksum.
-    if isGoodStr == True and USECHECKSUMS == True:
+    if isGoodStr and USECHECKSUMS:
 
         # Calculate the checksum. Take the bitwise exclusive OR of zero and
         # the first character following the leading '$', then the exclusive
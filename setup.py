@@ -0,0 +1,26 @@
+"""
+Builds the optional compiled NMEA checksum kernel:
+
+    python setup.py build_ext --inplace
+
+mvp_relay runs fine without it; the extension just speeds up the
+per-sentence checksum loop.
+"""
+
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+# -O3 -march=native lets the compiler turn the byte-wise XOR loops in
+# the kernel into wide SIMD reductions for this machine. The relay is
+# always built in place on the machine it runs on, so tuning for the
+# local ISA is safe.
+ext = Extension(
+    'nmea_fast',
+    ['nmea_fast.pyx'],
+    extra_compile_args=['-O3', '-march=native'],
+)
+
+setup(
+    name='mvp_relay',
+    ext_modules=cythonize([ext]),
+)